@@ -1,3 +1,333 @@
-from django.test import TestCase
+import asyncio
+import base64
+import io
+import os
+import subprocess
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
 
-# Create your tests here.
+import orjson
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase
+from docx import Document
+from docx.oxml import parse_xml
+from google.api_core.exceptions import InvalidArgument, ResourceExhausted
+from google.rpc import error_details_pb2
+
+from . import views
+
+
+def empty_cv(schema=views.WB_CV_SCHEMA):
+    # Smallest document that satisfies WB_CV_SCHEMA
+    if schema.get('type') == 'object':
+        return {key: empty_cv(value) for key, value in schema.get('properties', {}).items()}
+    if schema.get('type') == 'array':
+        return []
+    if 'enum' in schema:
+        return schema['enum'][0]
+    return ''
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+        self.parts = [text] if text else []
+
+
+class FakeModel:
+    # Stands in for genai.GenerativeModel; CV texts containing 'reject' fail at Gemini
+    async def generate_content_async(self, contents, generation_config=None, stream=False):
+        if 'reject' in contents[-1]:
+            raise InvalidArgument('rejected')
+        json_text = orjson.dumps(empty_cv()).decode()
+
+        async def chunks():
+            yield FakeChunk(json_text[:10])
+            yield FakeChunk(json_text[10:])
+        return chunks()
+
+
+class ProcessCvBatchViewTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(views, 'make_model', FakeModel)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_gemini_failure_only_fails_its_own_item(self):
+        response = await self.async_client.post('/api/process-cvs/', data={
+            'cv': [SimpleUploadedFile('good.txt', b'Name: John Doe'), SimpleUploadedFile('bad.txt', b'reject me')],
+        })
+        self.assertEqual(response.status_code, 200)
+        body = orjson.loads(response.content)
+        self.assertFalse(body['success'])
+        good, bad = body['results']
+        self.assertEqual((good['filename'], good['status'], good['success']), ('good.txt', 200, True))
+        self.assertEqual((bad['filename'], bad['status'], bad['success']), ('bad.txt', 502, False))
+
+    async def test_oversized_batch_is_rejected_before_reading(self):
+        files = [{'file_content': 'TmFtZQ==', 'filename': f'{i}.txt'} for i in range(3)]
+        with self.settings(MAX_CV_BATCH_FILES=2), mock.patch.object(views, 'read_json_upload') as read_json_upload:
+            response = await self.async_client.post(
+                '/api/process-cvs/', data={'files': files}, content_type='application/json')
+        read_json_upload.assert_not_called()
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Too many files', orjson.loads(response.content)['message'])
+
+    async def test_large_batches_must_be_sent_as_multipart(self):
+        content = b'x' * 3000
+        files = [{'file_content': base64.b64encode(content).decode(), 'filename': f'{i}.txt'} for i in range(2)]
+
+        async def fake_process_cv(binary, filename):
+            return {'success': True, 'cv_data': {}}, 200
+
+        with self.settings(DATA_UPLOAD_MAX_MEMORY_SIZE=5000), \
+                mock.patch.object(views, 'process_cv', side_effect=fake_process_cv):
+            response = await self.async_client.post(
+                '/api/process-cvs/', data={'files': files}, content_type='application/json')
+            self.assertEqual(response.status_code, 413)
+            self.assertIn('multipart', orjson.loads(response.content)['message'])
+
+            response = await self.async_client.post('/api/process-cvs/', data={
+                'cv': [SimpleUploadedFile(f'{i}.txt', content) for i in range(2)],
+            })
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(orjson.loads(response.content)['success'])
+
+    async def test_malformed_json_bodies_are_rejected(self):
+        for body in ([1, 2], {'files': 'a.txt'}, {'files': ['a.txt']}):
+            response = await self.async_client.post('/api/process-cvs/', data=body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+
+    async def test_batch_runs_each_item_through_process_cv(self):
+        async def fake_process_cv(binary, filename):
+            if filename == 'boom.txt':
+                raise RuntimeError('boom')
+            return {'success': True, 'cv_data': {'text': binary.decode()}}, 200
+
+        files = [
+            {'file_content': 'Rmlyc3Q=', 'filename': 'first.txt'},
+            {'filename': 'missing.txt'},
+            {'file_content': 'Qm9vbQ==', 'filename': 'boom.txt'},
+        ]
+        with mock.patch.object(views, 'process_cv', side_effect=fake_process_cv) as process_cv:
+            response = await self.async_client.post(
+                '/api/process-cvs/', data={'files': files}, content_type='application/json')
+        self.assertEqual(process_cv.call_count, 2)
+        self.assertEqual(response.status_code, 200)
+        first, missing, boom = orjson.loads(response.content)['results']
+        self.assertEqual(first, {'filename': 'first.txt', 'status': 200, 'success': True, 'cv_data': {'text': 'First'}})
+        self.assertEqual((missing['status'], missing['success']), (400, False))
+        self.assertEqual((boom['status'], boom['success']), (500, False))
+
+
+class ExtractDocxTextXmlTests(SimpleTestCase):
+    @staticmethod
+    def build_docx():
+        doc = Document()
+        doc.add_paragraph('Name:\tJohn Doe')
+        doc.add_paragraph('Python', style='List Bullet')
+        doc.add_paragraph('- already bulleted', style='List Bullet')
+        doc.add_paragraph('')
+        table = doc.add_table(rows=2, cols=3)
+        for cell, text in zip(table.rows[0].cells, ('University X', 'MSc', '2020')):
+            cell.text = text
+        table.cell(1, 0).text = 'Only cell'
+        doc.add_paragraph('After table')
+        buf = io.BytesIO()
+        doc.save(buf)
+        return buf.getvalue()
+
+    def test_paragraphs_and_tables_keep_document_order(self):
+        self.assertEqual(views.extract_docx_text_xml(self.build_docx()).splitlines(), [
+            'Name:\tJohn Doe',
+            '• Python',
+            '- already bulleted',
+            'University X | MSc | 2020',
+            'Only cell',
+            'After table',
+        ])
+
+    @staticmethod
+    def build_docx_with_text_box():
+        # A sidebar text box as Word saves it: DrawingML in mc:Choice, VML copy in mc:Fallback
+        lines = ('Phone: 123', 'Email: a@b.c')
+        txbx = '<w:txbxContent>%s</w:txbxContent>' % ''.join(f'<w:p><w:r><w:t>{line}</w:t></w:r></w:p>' for line in lines)
+        doc = Document()
+        paragraph = doc.add_paragraph('Summary')
+        paragraph._p.append(parse_xml(
+            '<w:r xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+            ' xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006"'
+            ' xmlns:wps="http://schemas.microsoft.com/office/word/2010/wordprocessingShape"'
+            ' xmlns:v="urn:schemas-microsoft-com:vml"><mc:AlternateContent>'
+            f'<mc:Choice Requires="wps"><w:drawing><wps:wsp><wps:txbx>{txbx}</wps:txbx></wps:wsp></w:drawing></mc:Choice>'
+            f'<mc:Fallback><w:pict><v:shape><v:textbox>{txbx}</v:textbox></v:shape></w:pict></mc:Fallback>'
+            '</mc:AlternateContent></w:r>'
+        ))
+        linked = doc.add_paragraph('Portfolio: ')
+        linked._p.append(parse_xml(
+            '<w:hyperlink xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            '<w:r><w:t>example.com</w:t></w:r><w:r><w:br w:type="page"/><w:t>/cv</w:t></w:r></w:hyperlink>'
+        ))
+        buf = io.BytesIO()
+        doc.save(buf)
+        return buf.getvalue()
+
+    def test_paragraph_text_matches_python_docx(self):
+        for binary in (self.build_docx(), self.build_docx_with_text_box()):
+            for paragraph in Document(io.BytesIO(binary)).paragraphs:
+                self.assertEqual(views.docx_paragraph_text(paragraph._p), paragraph.text)
+
+    def test_text_boxes_are_read_once_as_separate_lines(self):
+        self.assertEqual(views.extract_docx_text_xml(self.build_docx_with_text_box()).splitlines(), [
+            'Summary',
+            'Phone: 123',
+            'Email: a@b.c',
+            'Portfolio: example.com/cv',
+        ])
+
+    def test_stops_once_text_reaches_the_size_cap(self):
+        with self.settings(MAX_CV_TEXT_CHARS=20):
+            self.assertEqual(views.extract_docx_text_xml(self.build_docx()), 'Name:\tJohn Doe\n• Python')
+
+
+class ExtractPdfTextTests(SimpleTestCase):
+    def test_pymupdf_is_preferred_over_pdftotext(self):
+        with mock.patch.object(views, 'HAS_PYMUPDF', True), mock.patch.object(views, 'HAS_PDFTOTEXT', True), \
+                mock.patch.object(views, 'extract_pdf_text_pymupdf', return_value=['Uni X | MSc | 2020']), \
+                mock.patch.object(views, 'extract_pdf_text_pdftotext') as extract_pdf_text_pdftotext:
+            self.assertEqual(views.extract_text(b'%PDF', 'cv.pdf'), 'Uni X | MSc | 2020')
+        extract_pdf_text_pdftotext.assert_not_called()
+
+    def test_pdftotext_stands_in_without_pymupdf(self):
+        with mock.patch.object(views, 'HAS_PYMUPDF', False), mock.patch.object(views, 'HAS_PDFTOTEXT', True), \
+                mock.patch.object(views, 'extract_pdf_text_pdftotext', return_value=['Name: John Doe']):
+            self.assertEqual(views.extract_text(b'%PDF', 'cv.pdf'), 'Name: John Doe')
+
+
+class GetGeminiTests(SimpleTestCase):
+    def test_each_event_loop_gets_its_own_semaphore_and_model(self):
+        async def get_twice():
+            return views.get_gemini(), views.get_gemini()
+
+        with mock.patch.object(views, 'make_model', FakeModel):
+            first, again = asyncio.run(get_twice())
+            other, _ = asyncio.run(get_twice())
+        self.assertIs(first, again)
+        self.assertIsNot(first[0], other[0])
+        self.assertIsNot(first[1], other[1])
+
+
+class ExtractDocTextTests(SimpleTestCase):
+    def test_falls_back_to_libreoffice_when_antiword_times_out(self):
+        def run(cmd, **kwargs):
+            if cmd[0] == 'antiword':
+                raise subprocess.TimeoutExpired(cmd, kwargs['timeout'])
+            outdir = cmd[cmd.index('--outdir') + 1]
+            with open(os.path.join(outdir, 'cv.txt'), 'w') as f:
+                f.write('Converted by LibreOffice\n')
+            return subprocess.CompletedProcess(cmd, 0)
+
+        with mock.patch.object(views, 'ANTIWORD', 'antiword'), mock.patch.object(views, 'SOFFICE', 'soffice'), \
+                mock.patch.object(views.subprocess, 'run', side_effect=run):
+            self.assertEqual(views.extract_doc_text(b'legacy doc'), 'Converted by LibreOffice')
+
+    def test_libreoffice_gets_what_is_left_of_the_task_deadline(self):
+        timeouts = {}
+
+        def run(cmd, **kwargs):
+            timeouts[cmd[0]] = kwargs['timeout']
+            raise subprocess.TimeoutExpired(cmd, kwargs['timeout'])
+
+        with mock.patch.object(views, 'ANTIWORD', 'antiword'), mock.patch.object(views, 'SOFFICE', 'soffice'), \
+                mock.patch.object(views, '_EXTRACT_DEADLINE', time.monotonic() + 30), \
+                mock.patch.object(views.subprocess, 'run', side_effect=run):
+            with self.assertRaises(subprocess.TimeoutExpired):
+                views.extract_doc_text(b'legacy doc')
+        self.assertEqual(timeouts['antiword'], views.ANTIWORD_TIMEOUT)
+        self.assertLessEqual(timeouts['soffice'], 30 - views.EXTRACT_DEADLINE_MARGIN)
+        self.assertGreater(timeouts['soffice'], 25)
+
+    def test_error_says_antiword_failed_when_libreoffice_is_missing(self):
+        failed = subprocess.CompletedProcess(['antiword'], 1, stdout=b'', stderr=b'not a Word document')
+        with mock.patch.object(views, 'ANTIWORD', 'antiword'), mock.patch.object(views, 'SOFFICE', None), \
+                mock.patch.object(views.subprocess, 'run', return_value=failed):
+            with self.assertRaisesMessage(ValueError, 'antiword failed: not a Word document; LibreOffice is not installed'):
+                views.extract_doc_text(b'legacy doc')
+
+
+class FakePool:
+    def __init__(self, result=None, error=None):
+        self.result, self.error = result, error
+
+    def submit(self, fn, *args):
+        future = Future()
+        if self.error is not None:
+            future.set_exception(self.error)
+        else:
+            future.set_result(self.result)
+        return future
+
+
+class RunExtractionTests(SimpleTestCase):
+    async def test_broken_pool_is_replaced_and_the_task_retried(self):
+        broken, fresh = FakePool(error=BrokenProcessPool()), FakePool(result='CV text')
+        with mock.patch.object(views, 'get_extract_pool', side_effect=[broken, fresh]), \
+                mock.patch.object(views, 'discard_extract_pool') as discard_extract_pool:
+            self.assertEqual(await views.run_extraction(b'', 'cv.pdf'), 'CV text')
+        discard_extract_pool.assert_called_once_with(broken)
+
+    async def test_gives_up_when_the_fresh_pool_breaks_too(self):
+        with mock.patch.object(views, 'get_extract_pool', side_effect=lambda: FakePool(error=BrokenProcessPool())), \
+                mock.patch.object(views, 'discard_extract_pool'):
+            with self.assertRaises(BrokenProcessPool):
+                await views.run_extraction(b'', 'cv.pdf')
+
+    async def test_queued_tasks_do_not_time_out_waiting_for_a_worker(self):
+        # Each task needs most of the deadline, so the last of four queued behind a
+        # single worker would miss it if waiting time counted
+        def extract(binary, filename):
+            time.sleep(0.2)
+            return filename
+
+        with ThreadPoolExecutor(max_workers=1) as pool, \
+                mock.patch.object(views, 'EXTRACT_WORKERS', 1), \
+                mock.patch.object(views, 'EXTRACT_TIMEOUT', 0.2), \
+                mock.patch.object(views, 'EXTRACT_KILL_GRACE', 0.1), \
+                mock.patch.object(views, 'extract_text_with_deadline', extract), \
+                mock.patch.object(views, 'get_extract_pool', return_value=pool), \
+                mock.patch.object(views, 'discard_extract_pool') as discard_extract_pool:
+            results = await asyncio.gather(*(views.run_extraction(b'', f'{i}.pdf') for i in range(4)))
+        self.assertEqual(results, ['0.pdf', '1.pdf', '2.pdf', '3.pdf'])
+        discard_extract_pool.assert_not_called()
+
+    def test_deadline_interrupts_a_slow_extraction(self):
+        with mock.patch.object(views, 'EXTRACT_TIMEOUT', 1), \
+                mock.patch.object(views, 'extract_text', side_effect=lambda binary, filename: time.sleep(5)):
+            started = time.monotonic()
+            with self.assertRaises(views.ExtractTimeout):
+                views.extract_text_with_deadline(b'', 'cv.pdf')
+        self.assertLess(time.monotonic() - started, 3)
+
+
+class GetServerRetryDelayTests(SimpleTestCase):
+    def test_rest_detail(self):
+        error = ResourceExhausted('quota', details=[
+            {'@type': 'type.googleapis.com/google.rpc.QuotaFailure'},
+            {'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': '12s'},
+        ])
+        self.assertEqual(views.get_server_retry_delay(error), 12.0)
+
+    def test_grpc_detail(self):
+        retry_info = error_details_pb2.RetryInfo()
+        retry_info.retry_delay.seconds = 7
+        retry_info.retry_delay.nanos = 500_000_000
+        error = ResourceExhausted('quota', details=[retry_info])
+        self.assertEqual(views.get_server_retry_delay(error), 7.5)
+
+    def test_no_retry_info(self):
+        self.assertIsNone(views.get_server_retry_delay(ResourceExhausted('quota')))
+        self.assertIsNone(views.get_server_retry_delay(ResourceExhausted('quota', details=[{'retryDelay': 'soon'}])))
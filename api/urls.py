@@ -3,5 +3,6 @@ from . import views
 
 urlpatterns = [
     path('process-cv/', views.process_cv_view, name='process_cv'),
+    path('process-cvs/', views.process_cvs_batch_view, name='process_cvs_batch'),
     # path('generate-docx/', views.generate_docx_view, name='generate_docx'),
 ]
\ No newline at end of file
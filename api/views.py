@@ -1,14 +1,28 @@
 # views.py (full file)
 
-from dotenv import load_dotenv
 import os
-import json
+import functools
 import base64
+import binascii
+import asyncio
+import hashlib
 import io
-from django.http import JsonResponse, HttpResponse
+import importlib.util
+import zipfile
+import shutil
+import subprocess
+import tempfile
+import multiprocessing
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, RequestDataTooBig
+from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from docx import Document
 from docx.shared import Inches, Pt, Cm, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_BREAK
 from docx.enum.table import WD_TABLE_ALIGNMENT
@@ -16,21 +30,81 @@ from docx.oxml.ns import qn
 from docx.oxml import OxmlElement
 from docx.oxml.shared import OxmlElement as SharedOxmlElement
 import google.generativeai as genai
-from google.api_core.exceptions import GoogleAPIError
+from google.generativeai import client as genai_client
+from google.generativeai.types import generation_types
+from google.api_core.exceptions import (
+    GoogleAPIError, ResourceExhausted, ServiceUnavailable, DeadlineExceeded, InternalServerError,
+)
 import time
+import random
 import logging
 import traceback
-import textract
-import pdfplumber
-from PyPDF2 import PdfReader
-
-load_dotenv()  # Load environment variables from .env file
-API_KEY = os.environ.get("GOOGLE_API_KEY", "")
-if not API_KEY:
-    raise ValueError("GOOGLE_API_KEY is not set. Please configure it in the .env file or environment.")
-genai.configure(api_key=API_KEY)
+import orjson
+import jsonschema
+from lxml import etree
+
 MODEL_NAME = "gemini-2.0-flash"  # Use available model
 MAX_RETRIES = 3
+MAX_RETRY_DELAY = 30  # seconds
+# Transient Gemini failures worth retrying; anything else (InvalidArgument,
+# PermissionDenied, ...) fails the same way on every attempt
+RETRIABLE_GEMINI_ERRORS = (ResourceExhausted, ServiceUnavailable, DeadlineExceeded, InternalServerError)
+GEMINI_MAX_CONCURRENCY = 8  # in-flight Gemini calls per event loop (one per ASGI worker), keeps us under the per-minute quota
+EXTRACT_TIMEOUT = 60  # seconds
+EXTRACT_KILL_GRACE = 5  # seconds past EXTRACT_TIMEOUT before a wedged worker pool is killed
+EXTRACT_WORKERS = os.cpu_count()
+PDFTOTEXT_TIMEOUT = 30  # seconds
+MAX_PDF_PAGES = 30  # CVs rarely run past ~20 pages; ignore anything beyond this
+PDF_PAGE_TIME_BUDGET = 5  # seconds of pdfplumber text extraction before a page's tables are skipped
+
+# poppler's pdftotext is fast but finds no tables, so it only stands in for PyMuPDF
+HAS_PDFTOTEXT = shutil.which('pdftotext') is not None
+# Native PDF libraries are only imported when a PDF actually needs them
+HAS_PYMUPDF = importlib.util.find_spec('fitz') is not None
+# pypdfium2 arrives with pdfplumber; it is only used as a fallback when PyMuPDF is missing
+HAS_PDFIUM = importlib.util.find_spec('pypdfium2') is not None
+
+# Legacy .doc files are converted by antiword, or LibreOffice when antiword is missing or fails
+ANTIWORD = shutil.which('antiword')
+SOFFICE = shutil.which('soffice') or shutil.which('libreoffice')
+ANTIWORD_TIMEOUT = 20  # seconds
+SOFFICE_TIMEOUT = 60  # seconds, LibreOffice has a slow cold start
+# Converters are cut short to finish this many seconds before the task's EXTRACT_TIMEOUT
+EXTRACT_DEADLINE_MARGIN = 2  # seconds
+
+# Text extraction is CPU-bound, so it runs in worker processes rather than on the
+# request thread. The pool is created on first use and replaced if a worker dies
+# (e.g. a native PDF library crashing, or the OOM killer) or gets stuck.
+_EXTRACT_POOL = None
+_EXTRACT_POOL_LOCK = threading.Lock()
+# When the running extraction task's alarm fires (monotonic clock; pool workers only)
+_EXTRACT_DEADLINE = None
+
+# WordprocessingML tags used when reading .docx text straight from the XML
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+W_BODY = f'{{{W_NS}}}body'
+W_P = f'{{{W_NS}}}p'
+W_R = f'{{{W_NS}}}r'
+W_T = f'{{{W_NS}}}t'
+W_TAB = f'{{{W_NS}}}tab'
+W_BR = f'{{{W_NS}}}br'
+W_CR = f'{{{W_NS}}}cr'
+W_PTAB = f'{{{W_NS}}}ptab'
+W_NO_BREAK_HYPHEN = f'{{{W_NS}}}noBreakHyphen'
+W_TYPE = f'{{{W_NS}}}type'
+W_HYPERLINK = f'{{{W_NS}}}hyperlink'
+W_TXBX_CONTENT = f'{{{W_NS}}}txbxContent'
+W_TBL = f'{{{W_NS}}}tbl'
+W_TR = f'{{{W_NS}}}tr'
+W_TC = f'{{{W_NS}}}tc'
+W_PPR = f'{{{W_NS}}}pPr'
+W_PSTYLE = f'{{{W_NS}}}pStyle'
+W_NUMPR = f'{{{W_NS}}}numPr'
+W_VAL = f'{{{W_NS}}}val'
+# Word saves each text box twice: as DrawingML (mc:Choice) and as VML (mc:Fallback)
+MC_FALLBACK = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'
+# First characters that already mark a line as a bullet point
+BULLET_CHARS = frozenset('*-•')
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -168,165 +242,657 @@ WB_CV_SCHEMA = {
     ]
 }
 
-def extract_text(base64_content, filename):
+# Static part of the extraction prompt; the CV text follows it as a separate part
+PROMPT_PREFIX = (
+    "You are an expert in extracting data from CVs strictly according to the World Bank FORM TECH-6 template.\n\n"
+    "Extract ONLY information explicitly stated in the CV text. Do NOT invent, assume, infer, modify, or add any data. "
+    "Every field of the response schema must be present: use '' for missing strings and [] for missing lists; "
+    "worked_for_world_bank defaults to 'No'.\n\n"
+    "Preserve original wording, phrasing, capitalization, and formatting. Normalize dates to 'YYYY', 'YYYY-MM', "
+    "or 'YYYY-MM-DD' only if they are clearly dates; otherwise leave them as-is.\n\n"
+    "The CV text may contain plain paragraphs ('Name: John Doe'), table rows separated by ' | ' "
+    "('University X | MSc | 2020') and bullet points starting with '*', '-', or '•'. Identify sections by number "
+    "(1., 2., etc.) or headings (Education, Languages, etc.). Keep array items in the order they appear, except "
+    "employment_record, which is reverse chronological if dates can be parsed.\n\n"
+    "CV text:\n"
+)
+
+# Compact string form of the schema, serialised once. Together with the prompt it
+# fingerprints cached results, so changing either one invalidates them.
+SCHEMA_JSON = orjson.dumps(WB_CV_SCHEMA).decode()
+PROMPT_FINGERPRINT = hashlib.sha256((PROMPT_PREFIX + SCHEMA_JSON).encode()).hexdigest()[:16]
+# Bump to drop cached results after changes the fingerprint can't see (e.g.
+# text extraction, post-processing). Both the parsed CV and extracted text cache
+# keys include it.
+PROMPT_VERSION = 1
+
+# Checks each Gemini reply against the schema; compiled once rather than per response
+_VALIDATOR = jsonschema.Draft7Validator(WB_CV_SCHEMA)
+
+# The config is converted to its request form up front: given a GenerationConfig,
+# genai deep-copies the schema dict and rebuilds a protos.Schema on every call,
+# while a dict already holding a protos.Schema is passed through as-is
+_GEN_CONFIG = generation_types.to_generation_config_dict(genai.types.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=WB_CV_SCHEMA
+))
+
+# Loop-bound objects (asyncio semaphores, genai's grpc.aio client) per running event
+# loop, created lazily (so never in the extraction workers). They can't be shared
+# between loops. Under ASGI (see gunicorn.conf.py) each worker has one loop and so
+# one of each; under WSGI or runserver, Django runs every async view in a fresh
+# loop, which gets its own.
+_LOOP_GEMINI = {}
+_LOOP_EXTRACT_SLOTS = {}
+_LOOP_LOCAL_LOCK = threading.Lock()
+
+@functools.cache
+def get_api_key():
+    # Read once, on first use rather than at import (call cache_clear() to re-read)
+    if not settings.GOOGLE_API_KEY:
+        raise ImproperlyConfigured("GOOGLE_API_KEY is not set. Please configure it in the .env file or environment.")
+    return settings.GOOGLE_API_KEY
+
+@functools.cache
+def configure_genai():
+    genai.configure(api_key=get_api_key())
+
+def make_model():
+    configure_genai()
+    model = genai.GenerativeModel(MODEL_NAME)
+    # genai otherwise shares one process-wide async client, tied to whichever loop
+    # used it first (private attribute; genai is pinned in requirements.txt)
+    model._async_client = genai_client._client_manager.make_client('generative_async')
+    return model
+
+def loop_local(registry, factory):
+    # registry's value for the running event loop, created by factory() on first use
+    loop = asyncio.get_running_loop()
+    with _LOOP_LOCAL_LOCK:
+        value = registry.get(loop)
+        if value is None:
+            # Values may reference their loop (the gRPC client does), so entries are
+            # dropped by hand once their loop has closed rather than via weak references
+            for closed in [other for other in registry if other.is_closed()]:
+                del registry[closed]
+            value = registry[loop] = factory()
+    return value
+
+def get_gemini():
+    # (semaphore, model) for the running event loop
+    return loop_local(_LOOP_GEMINI, lambda: (asyncio.Semaphore(GEMINI_MAX_CONCURRENCY), make_model()))
+
+def get_extract_slots():
+    # One slot per pool worker: a task only starts its timeout once it holds a slot,
+    # so time spent queued behind other extractions doesn't count against it
+    return loop_local(_LOOP_EXTRACT_SLOTS, lambda: asyncio.Semaphore(EXTRACT_WORKERS))
+
+def get_extract_pool():
+    global _EXTRACT_POOL
+    with _EXTRACT_POOL_LOCK:
+        if _EXTRACT_POOL is None:
+            # 'spawn' keeps the workers clear of the parent's gRPC threads. Each worker
+            # leads its own process group, so killing it also takes down any
+            # pdftotext/antiword/soffice child it started.
+            _EXTRACT_POOL = ProcessPoolExecutor(
+                max_workers=EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=os.setpgrp,
+            )
+        return _EXTRACT_POOL
+
+def discard_extract_pool(pool, kill=False):
+    # Drop a broken or wedged pool; the next get_extract_pool() starts a fresh one
+    global _EXTRACT_POOL
+    with _EXTRACT_POOL_LOCK:
+        if _EXTRACT_POOL is pool:
+            _EXTRACT_POOL = None
+    if kill:
+        # A worker stuck in native code never sees its alarm, so free the slots by force
+        for process in list((pool._processes or {}).values()):
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def stripped_lines(text):
+    return (line for line in (raw.strip() for raw in text.splitlines()) if line)
+
+def table_row_text(cells):
+    # One ' | ' separated line per table row, skipping empty cells
+    return ' | '.join(c for c in (str(cell).strip() for cell in cells if cell is not None) if c)
+
+def docx_run_text(r):
+    parts = []
+    for el in r:
+        if el.tag == W_T:
+            parts.append(el.text or '')
+        elif el.tag in (W_TAB, W_PTAB):
+            parts.append('\t')
+        elif el.tag == W_CR or (el.tag == W_BR and el.get(W_TYPE, 'textWrapping') == 'textWrapping'):
+            parts.append('\n')  # Page and column breaks add nothing
+        elif el.tag == W_NO_BREAK_HYPHEN:
+            parts.append('-')
+    return ''.join(parts)
+
+def docx_paragraph_text(p):
+    # Same text python-docx gives for Paragraph.text: the paragraph's own runs and
+    # hyperlink runs only, so text boxes anchored in a run are not pulled in here
+    parts = []
+    for child in p:
+        if child.tag == W_R:
+            parts.append(docx_run_text(child))
+        elif child.tag == W_HYPERLINK:
+            parts.extend(docx_run_text(r) for r in child.iterfind(W_R))
+    return ''.join(parts)
+
+def docx_text_boxes(block):
+    # Outermost text boxes inside block, skipping the VML fallback copies
+    for txbx in block.iter(W_TXBX_CONTENT):
+        parent = txbx.getparent()
+        while parent is not block and parent.tag not in (MC_FALLBACK, W_TXBX_CONTENT):
+            parent = parent.getparent()
+        if parent is block:
+            yield txbx
+
+def is_docx_list_paragraph(p):
+    pPr = p.find(W_PPR)
+    if pPr is None:
+        return False
+    if pPr.find(W_NUMPR) is not None:
+        return True
+    pStyle = pPr.find(W_PSTYLE)
+    return pStyle is not None and (pStyle.get(W_VAL) or '').startswith('List')
+
+def write_docx_line(out, line):
+    if out.tell():
+        out.write('\n')
+    out.write(line)
+
+def write_docx_block_text(out, block):
+    # Text of one top-level w:p or w:tbl element
+    if block.tag == W_P:
+        txt = docx_paragraph_text(block).strip()
+        if txt:
+            # Text that already starts with a bullet needs no list lookup
+            if txt[0] not in BULLET_CHARS and is_docx_list_paragraph(block):
+                txt = '• ' + txt
+            write_docx_line(out, txt)
+    elif block.tag == W_TBL:
+        for tr in block.iterfind(W_TR):
+            row = table_row_text('\n'.join(docx_paragraph_text(p) for p in tc.iterfind(W_P)) for tc in tr.iterfind(W_TC))
+            if row:
+                write_docx_line(out, row)
+    # Text boxes (e.g. a contact sidebar) follow the block they are anchored in, one
+    # line per paragraph
+    for txbx in docx_text_boxes(block):
+        for child in txbx:
+            write_docx_block_text(out, child)
+
+def extract_docx_body_text(body):
+    # Walk w:body's children in document order, pulling text straight from the XML
+    out = io.StringIO()
+    for child in body:
+        write_docx_block_text(out, child)
+        if out.tell() >= settings.MAX_CV_TEXT_CHARS:
+            break  # Anything further would be cut before reaching Gemini anyway
+    return out.getvalue()
+
+def extract_docx_text_xml(binary):
+    # Stream word/document.xml out of the zip instead of building the whole tree:
+    # each top-level paragraph/table is handled as soon as it is complete and then
+    # freed, so memory stays at roughly one block rather than the whole document.
+    # Text goes straight into one StringIO buffer instead of a list of lines.
+    out = io.StringIO()
+    with zipfile.ZipFile(io.BytesIO(binary)) as z, z.open('word/document.xml') as f:
+        for _, elem in etree.iterparse(f, events=('end',), tag=(W_P, W_TBL), resolve_entities=False):
+            parent = elem.getparent()
+            if parent is None or parent.tag != W_BODY:
+                continue  # Nested block; read together with its top-level parent
+            write_docx_block_text(out, elem)
+            if out.tell() >= settings.MAX_CV_TEXT_CHARS:
+                break  # Anything further would be cut before reaching Gemini anyway
+            elem.clear()
+            while elem.getprevious() is not None:
+                del parent[0]
+    return out.getvalue()
+
+def extract_docx_text_python_docx(binary):
+    # python-docx finds the main document part through the package relationships,
+    # which copes with files that don't use word/document.xml. Only its parsed XML
+    # is used; no Paragraph/Table/_Cell wrappers are built.
+    from docx import Document
+
+    doc = Document(io.BytesIO(binary))
+    return extract_docx_body_text(doc.element.body)
+
+def extract_pdf_text_pdftotext(binary):
+    try:
+        result = subprocess.run(
+            # Reading order, not -layout, which puts the columns of a two-column CV side by side
+            ['pdftotext', '-l', str(MAX_PDF_PAGES), '-', '-'],
+            input=binary, capture_output=True, timeout=PDFTOTEXT_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        logger.warning(f"pdftotext timed out after {PDFTOTEXT_TIMEOUT} seconds")
+        return []
+    if result.returncode != 0:
+        logger.warning(f"pdftotext failed: {result.stderr.decode('utf-8', 'ignore').strip()}")
+        return []
+    return list(stripped_lines(result.stdout.decode('utf-8', 'ignore')))
+
+def extract_pdf_text_pymupdf(binary):
+    import fitz  # PyMuPDF
+
+    full_text = []
+    doc = fitz.open(stream=binary, filetype='pdf')
+    try:
+        for page in doc.pages(0, min(doc.page_count, MAX_PDF_PAGES)):
+            full_text.extend(stripped_lines(page.get_text("text")))
+            for table in page.find_tables().tables:
+                full_text.extend(row for row in map(table_row_text, table.extract()) if row)
+    finally:
+        doc.close()
+    return full_text
+
+def extract_pdf_text_pdfium(binary):
+    # PDFium (Chrome's PDF engine): fast plain text, but no table detection
+    import pypdfium2 as pdfium
+
+    full_text = []
+    pdf = pdfium.PdfDocument(binary)
+    try:
+        for index in range(min(len(pdf), MAX_PDF_PAGES)):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            text = textpage.get_text_range()
+            textpage.close()
+            page.close()
+            full_text.extend(stripped_lines(text))
+    finally:
+        pdf.close()
+    return full_text
+
+def extract_pdf_text_pdfplumber(binary):
+    import pdfplumber  # Only needed for the rare PDFs the native backends can't read text from
+
+    # No laparams on purpose: pdfplumber then skips pdfminer's layout analysis,
+    # which is where the pathological worst-case times come from
+    full_text = []
+    with pdfplumber.open(io.BytesIO(binary)) as pdf:
+        for page in pdf.pages[:MAX_PDF_PAGES]:
+            started = time.monotonic()
+            text = page.extract_text()
+            if text:
+                full_text.extend(stripped_lines(text))
+            # A page that was already slow to read is not worth table detection too
+            if time.monotonic() - started > PDF_PAGE_TIME_BUDGET:
+                logger.warning(f"Skipping table extraction on slow PDF page {page.page_number}")
+            else:
+                for table in page.extract_tables():
+                    full_text.extend(row for row in map(table_row_text, table) if row)
+            page.close()
+    return full_text
+
+def extract_time_left(limit):
+    # limit, cut down to what the running task's deadline still allows
+    if _EXTRACT_DEADLINE is None:
+        return limit
+    return min(limit, _EXTRACT_DEADLINE - time.monotonic() - EXTRACT_DEADLINE_MARGIN)
+
+def extract_doc_text(binary):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'cv.doc')
+        with open(path, 'wb') as f:
+            f.write(binary)
+
+        antiword_error = None
+        if ANTIWORD:
+            timeout = extract_time_left(ANTIWORD_TIMEOUT)
+            try:
+                result = subprocess.run(
+                    [ANTIWORD, '-m', 'UTF-8.txt', path],
+                    capture_output=True, timeout=timeout,
+                )
+            except subprocess.TimeoutExpired:
+                antiword_error = f"antiword timed out after {timeout:.0f} seconds"
+            else:
+                if result.returncode == 0:
+                    return result.stdout.decode('utf-8', 'ignore').strip()
+                antiword_error = f"antiword failed: {result.stderr.decode('utf-8', 'ignore').strip()}"
+            logger.warning(antiword_error)
+
+        if SOFFICE:
+            # Whatever antiword left of the deadline, so a slow conversion fails here
+            # with a clear error rather than being cut off by the task's alarm
+            timeout = extract_time_left(SOFFICE_TIMEOUT)
+            if timeout <= 0:
+                raise ValueError(f"{antiword_error}; no time left to try LibreOffice")
+            # Private profile dir so concurrent conversions don't fight over the default one
+            subprocess.run(
+                [SOFFICE, f'-env:UserInstallation=file://{tmpdir}/profile', '--headless',
+                 '--convert-to', 'txt:Text', '--outdir', tmpdir, path],
+                capture_output=True, timeout=timeout, check=True,
+            )
+            with open(os.path.join(tmpdir, 'cv.txt'), encoding='utf-8', errors='ignore') as f:
+                return f.read().strip()
+
+    if antiword_error:
+        raise ValueError(f"{antiword_error}; LibreOffice is not installed to try instead")
+    raise ValueError("Cannot read .doc files: neither antiword nor LibreOffice is installed")
+
+class ExtractTimeout(Exception):
+    pass
+
+def raise_extract_timeout(signum, frame):
+    raise ExtractTimeout(f"Text extraction took longer than {EXTRACT_TIMEOUT} seconds")
+
+def extract_text_with_deadline(binary, filename):
+    # Runs in a pool worker, where tasks execute on the main thread, so SIGALRM can
+    # interrupt a slow extraction and free the worker for the next task
+    global _EXTRACT_DEADLINE
+    signal.signal(signal.SIGALRM, raise_extract_timeout)
+    _EXTRACT_DEADLINE = time.monotonic() + EXTRACT_TIMEOUT
+    signal.alarm(EXTRACT_TIMEOUT)
+    try:
+        return extract_text(binary, filename)
+    finally:
+        signal.alarm(0)
+        _EXTRACT_DEADLINE = None
+
+def extract_text(binary, filename):
     try:
         ext = filename.lower().split('.')[-1]
-        binary = base64.b64decode(base64_content)
 
         full_text = []
 
         if ext == 'docx':
-            doc = Document(io.BytesIO(binary))
-            # Extract paragraph text
-            for para in doc.paragraphs:
-                if para.text.strip():
-                    full_text.append(para.text.strip())
-            # Extract text from tables
-            for table in doc.tables:
-                for row in table.rows:
-                    row_text = [cell.text.strip() for cell in row.cells if cell.text.strip()]
-                    if row_text:
-                        full_text.append(' | '.join(row_text))
-            # Extract bullet points
-            for para in doc.paragraphs:
-                if para.style.name.startswith('List') or para.text.strip().startswith(('*', '-', '•')):
-                    full_text.append(para.text.strip())
+            try:
+                full_text.append(extract_docx_text_xml(binary))
+            except (KeyError, zipfile.BadZipFile, etree.XMLSyntaxError) as e:
+                logger.warning(f"Falling back to python-docx for {filename}: {e}")
+                full_text.append(extract_docx_text_python_docx(binary))
         
         elif ext == 'pdf':
-            with pdfplumber.open(io.BytesIO(binary)) as pdf:
-                for page in pdf.pages:
-                    text = page.extract_text()
-                    if text:
-                        lines = text.split('\n')
-                        for line in lines:
-                            stripped = line.strip()
-                            if stripped:
-                                full_text.append(stripped)
-                    tables = page.extract_tables()
-                    for table in tables:
-                        for row in table:
-                            row_text = [str(cell).strip() for cell in row if cell is not None and str(cell).strip()]
-                            if row_text:
-                                full_text.append(' | '.join(row_text))
+            # PyMuPDF first: it is the only native backend that emits table rows
+            # (' | ' separated), which the prompt tells Gemini to expect
+            if HAS_PYMUPDF:
+                full_text.extend(extract_pdf_text_pymupdf(binary))
+            elif HAS_PDFTOTEXT:
+                full_text.extend(extract_pdf_text_pdftotext(binary))
+            elif HAS_PDFIUM:
+                full_text.extend(extract_pdf_text_pdfium(binary))
+            # No text layer (e.g. scanned PDF) or no native backend: give pdfplumber a try
+            if not full_text:
+                full_text.extend(extract_pdf_text_pdfplumber(binary))
         
         elif ext == 'txt':
             full_text.append(binary.decode('utf-8').strip())
         
         elif ext == 'doc':
-            text = textract.process(io.BytesIO(binary))
-            full_text.append(text.decode('utf-8').strip())
+            full_text.append(extract_doc_text(binary))
         
         else:
             raise ValueError(f"Unsupported file type: {ext}")
 
         extracted_text = "\n".join(full_text)
-        logger.info(f"Extracted text from {ext.upper()} (length: {len(extracted_text)}): {extracted_text[:500]}...")  # Log snippet
+        logger.info("Extracted text from %s (length: %s)", ext.upper(), len(extracted_text))
+        if logger.isEnabledFor(logging.DEBUG):  # Skip slicing the text when DEBUG is off
+            logger.debug("Extracted text snippet: %s...", extracted_text[:500])
         return extracted_text
+    except ExtractTimeout:
+        raise
     except Exception as e:
         logger.error(f"Error extracting text from file: {e}")
         return ""
 
+def json_response(payload, status=200):
+    # orjson serialises the (often multi-KB) CV payloads much faster than JsonResponse
+    return HttpResponse(orjson.dumps(payload), status=status, content_type='application/json')
+
+def get_server_retry_delay(error):
+    # Quota errors (429) carry a RetryInfo detail with the wait the server asks for
+    for detail in getattr(error, 'details', None) or []:
+        if isinstance(detail, dict):  # REST transport returns plain dicts
+            retry_delay = detail.get('retryDelay')
+            if retry_delay:
+                try:
+                    return float(str(retry_delay).rstrip('s'))
+                except ValueError:
+                    continue
+        else:
+            retry_delay = getattr(detail, 'retry_delay', None)
+            if retry_delay is not None:
+                return retry_delay.seconds + retry_delay.nanos / 1e9
+    return None
+
+def too_large_message():
+    return f'File is too large (max {settings.MAX_CV_BYTES // (1024 * 1024)} MB).'
+
+def read_multipart_upload(upload):
+    # Raw file upload: no base64 round-trip. Returns (binary, filename, error)
+    if upload.size > settings.MAX_CV_BYTES:
+        return None, upload.name, ({'success': False, 'message': too_large_message()}, 413)
+    return upload.read(), upload.name, None
+
+def read_json_upload(data):
+    # Legacy JSON upload with base64 file content. Returns (binary, filename, error)
+    file_content_base64 = data.get('file_content')
+    filename = data.get('filename')
+
+    if not file_content_base64 or not filename:
+        return None, filename, ({'success': False, 'message': 'File content or filename is missing.'}, 400)
+
+    # Reject oversized uploads before decoding (base64 is ~4/3 of the raw size)
+    if len(file_content_base64) * 3 // 4 > settings.MAX_CV_BYTES:
+        return None, filename, ({'success': False, 'message': too_large_message()}, 413)
+
+    try:
+        return base64.b64decode(file_content_base64), filename, None
+    except binascii.Error:
+        return None, filename, ({'success': False, 'message': 'File content is not valid base64.'}, 400)
+
+def content_sha256(binary):
+    return hashlib.sha256(binary).hexdigest()
+
+async def run_extraction(binary, filename):
+    # Retried once on a fresh pool: a dead worker breaks the whole pool, so tasks
+    # that merely shared it with the crashing file fail too
+    for attempt in range(2):
+        async with get_extract_slots():
+            pool = get_extract_pool()
+            try:
+                return await asyncio.wait_for(
+                    asyncio.wrap_future(pool.submit(extract_text_with_deadline, binary, filename)),
+                    timeout=EXTRACT_TIMEOUT + EXTRACT_KILL_GRACE,
+                )
+            except BrokenProcessPool:
+                logger.warning(f"Extraction pool broke while processing {filename}; starting a new one")
+                discard_extract_pool(pool)
+                if attempt:
+                    raise
+            except asyncio.TimeoutError:
+                # The worker ignored its alarm; recycle the pool so it can't hold a slot forever
+                discard_extract_pool(pool, kill=True)
+                raise
+
+async def process_cv(binary, filename):
+    # Extract and parse one CV. Returns (payload, status)
+    # Identical uploads skip both extraction and the Gemini round-trip
+    # hashlib releases the GIL on large buffers, so hashing in a thread lets other
+    # requests keep running on the loop meanwhile
+    content_hash = await asyncio.to_thread(content_sha256, binary)
+    cache_key = f'cv:{PROMPT_VERSION}:{PROMPT_FINGERPRINT}:{MODEL_NAME}:{content_hash}'
+    cached_cv_data = await cache.aget(cache_key)
+    if cached_cv_data is not None:
+        logger.info(f"Returning cached CV data for {filename}")
+        return {'success': True, 'cv_data': cached_cv_data}, 200
+
+    text_cache_key = f'txt:{PROMPT_VERSION}:{content_hash}'
+    cv_text = await cache.aget(text_cache_key)
+    if cv_text is None:
+        try:
+            cv_text = await run_extraction(binary, filename)
+        except (asyncio.TimeoutError, ExtractTimeout):
+            logger.error(f"Timed out extracting text from {filename} after {EXTRACT_TIMEOUT} seconds")
+            return {'success': False, 'message': 'Timed out extracting text from file.'}, 504
+        except BrokenProcessPool:
+            logger.error(f"Text extraction crashed on {filename}")
+            return {'success': False, 'message': 'Failed to extract text from file.'}, 500
+        if cv_text:
+            await cache.aset(text_cache_key, cv_text, timeout=settings.CV_CACHE_TIMEOUT)
+    if not cv_text:
+        return {'success': False, 'message': 'Failed to extract text from file.'}, 400
+    # Bound the prompt size (and Gemini token cost) for very long documents
+    if len(cv_text) > settings.MAX_CV_TEXT_CHARS:
+        logger.warning(f"Truncating text of {filename} from {len(cv_text)} to {settings.MAX_CV_TEXT_CHARS} characters")
+        cv_text = cv_text[:settings.MAX_CV_TEXT_CHARS]
+
+    # Prompt and CV text go as separate parts of one turn, so the (possibly
+    # large) CV text is never copied into a concatenated prompt string
+    contents = [PROMPT_PREFIX, cv_text]
+    semaphore, model = get_gemini()
+
+    last_error = None
+    for attempt in range(MAX_RETRIES):
+        try:
+            # Stream the reply so chunks are consumed as they arrive
+            async with semaphore:
+                stream = await model.generate_content_async(contents, generation_config=_GEN_CONFIG, stream=True)
+                buf = io.StringIO()
+                async for chunk in stream:
+                    if chunk.parts:
+                        buf.write(chunk.text)
+            json_text = buf.getvalue()
+            parsed_cv_data = orjson.loads(json_text)
+            _VALIDATOR.validate(parsed_cv_data)
+            logger.info("Successfully processed CV data (%s chars of JSON)", len(json_text))
+            logger.debug("Parsed CV data: %s", parsed_cv_data)
+            await cache.aset(cache_key, parsed_cv_data, timeout=settings.CV_CACHE_TIMEOUT)
+            return {'success': True, 'cv_data': parsed_cv_data}, 200
+        except (orjson.JSONDecodeError, jsonschema.ValidationError) as e:
+            # Malformed output is never cached or returned; ask again right away.
+            # str() of a ValidationError includes the whole schema, so keep the message
+            last_error = getattr(e, 'message', e)
+            logger.warning(f"Gemini output does not match WB_CV_SCHEMA on attempt {attempt + 1}: {last_error}")
+        except GoogleAPIError as e:
+            last_error = e
+            logger.error(f"Gemini API Error on attempt {attempt + 1}: {e}")
+            if not isinstance(e, RETRIABLE_GEMINI_ERRORS):
+                error_message = f"AI service rejected the request: {e}"
+                logger.error(error_message)
+                return {'success': False, 'error': error_message}, 502
+            if attempt < MAX_RETRIES - 1:
+                server_delay = get_server_retry_delay(e)
+                if server_delay is not None:
+                    delay = min(max(server_delay, 1), MAX_RETRY_DELAY)
+                else:
+                    # Full jitter so concurrent requests don't retry in lockstep
+                    delay = random.uniform(0, min(2 ** attempt, MAX_RETRY_DELAY))
+                logger.info(f"Retrying in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+
+    error_message = f"Failed to communicate with AI service after {MAX_RETRIES} retries. Last error: {last_error}"
+    logger.error(error_message)
+    return {'success': False, 'error': error_message}, 503
+
 @csrf_exempt
 @require_http_methods(["POST"])
-def process_cv_view(request):
+async def process_cv_view(request):
     try:
-        data = json.loads(request.body)
-        file_content_base64 = data.get('file_content')
-        filename = data.get('filename')
-
-        if not file_content_base64 or not filename:
-            return JsonResponse({'success': False, 'message': 'File content or filename is missing.'}, status=400)
-
-        cv_text = extract_text(file_content_base64, filename)
-        if not cv_text:
-            return JsonResponse({'success': False, 'message': 'Failed to extract text from file.'}, status=400)
-
-        model = genai.GenerativeModel(MODEL_NAME)
-        prompt = (
-            """You are an expert in extracting data from CVs strictly according to the World Bank FORM TECH-6 template. 
-
-                Your sole task is to parse the provided CV text and extract ONLY the information that is explicitly stated. Do NOT invent, assume, infer, modify, or add any data. If a value or section is not present, missing, or unclear, you MUST return an empty string ('') for strings, and an empty array ([]) for lists or arrays in the output.
-
-                Every field listed in the JSON schema below must be present in your output, even if the corresponding data is missing from the CV. If data is not found for a particular field, provide the exact required empty value for that field ('' or []). Under NO circumstances should you omit any fields or return a partial/malformed object.
-
-                Preserve original wording, phrasing, capitalization, and formatting as much as possible. Normalize dates only to 'YYYY', 'YYYY-MM', or 'YYYY-MM-DD' formats if they are clearly dates; otherwise, leave as-is.
-
-                The CV text may contain:
-                - Plain paragraphs: e.g., 'Name: John Doe'
-                - Table rows separated by ' | ', e.g., 'University X | MSc | 2020'
-                - Bullet points starting with '*', '-', or '•'
-
-                Identify sections by number (1., 2., etc.) or headings (Education, Languages, etc.). Extract all required information as arrays in the order they appear, sorting employment_record in reverse chronological order if dates can be parsed.
-
-                Fields to extract (all must be present in output, always fill with either actual data or empty as instructed above):
-                1. name: Extract full name after 'Name' or similar; '' if not found.
-                2. expert_contact_information: Object with phone (extract phone/mobile, '' if missing) and email (extract email, '' if missing).
-                3. proposed_position: Extract after 'Proposed Position' or similar; '' if not found.
-                4. employer: Extract current/primary employer; '' if not found.
-                5. date_of_birth: Extract birth date exactly; '' if not found.
-                6. nationality: Extract nationality; '' if not found.
-                7. education: Array of objects from education section/table, or [] if not found. For each: school_university, degree, date_obtained (all fields '' if missing).
-                8. membership_in_professional_associations: Multi-line string; '' if not found.
-                9. publications: Multi-line string; '' if not found.
-                10. other_training: Training text, combine lines as needed; '' if not found.
-                11. countries_experience: Comma-separated string; '' if not found.
-                12. languages: Array of objects from languages section, or [] if not found. For each: language, speaking, reading, writing (all fields '' if missing).
-                13. employment_record: Array of objects, or [] if not found. See schema for required subfields; use '' for any missing string field.
-                14. detailed_tasks: Array of strings; [] if not found.
-                15. work_undertaken: Array of project objects, or [] if not found. All subfields as above.
-                16. worked_for_world_bank: Extract answer to World Bank work question; default to 'No' if absent.
-
-                Below is the required JSON schema. Output ONLY a JSON object with EVERY field as described; do not output any additional explanation, text, or formatting."""
-                "CV text:\n"
-            f"{cv_text}"
-        )
+        if request.content_type.startswith('multipart/'):
+            upload = request.FILES.get('cv')
+            if upload is None:
+                return json_response({'success': False, 'message': 'File is missing.'}, status=400)
+            binary, filename, error = read_multipart_upload(upload)
+        else:
+            data = orjson.loads(request.body)
+            if not isinstance(data, dict):
+                return json_response({'success': False, 'message': 'Invalid JSON body.'}, status=400)
+            binary, filename, error = read_json_upload(data)
+        if error is not None:
+            payload, status = error
+            return json_response(payload, status=status)
 
-        config = genai.types.GenerationConfig(
-            response_mime_type="application/json",
-            response_schema=WB_CV_SCHEMA
-        )
+        payload, status = await process_cv(binary, filename)
+        return json_response(payload, status=status)
 
-        last_error = None
-        for attempt in range(MAX_RETRIES):
-            try:
-                response = model.generate_content([prompt], generation_config=config)
-                json_text = response.text
-                parsed_cv_data = json.loads(json_text)
-                logger.info(f"Successfully processed CV data: {parsed_cv_data}")
-                return JsonResponse({'success': True, 'cv_data': parsed_cv_data})
-            except GoogleAPIError as e:
-                last_error = e
-                logger.error(f"Gemini API Error on attempt {attempt + 1}: {e}")
-                if attempt < MAX_RETRIES - 1:
-                    delay = 2 ** attempt
-                    logger.info(f"Retrying in {delay} seconds...")
-                    time.sleep(delay)
-
-        error_message = f"Failed to communicate with AI service after {MAX_RETRIES} retries. Last error: {last_error}"
-        logger.error(error_message)
-        return JsonResponse({"error": error_message}, status=503)
-
-    except json.JSONDecodeError:
-        return JsonResponse({'success': False, 'message': 'Invalid JSON body.'}, status=400)
+    except RequestDataTooBig:
+        return json_response({'success': False, 'message': 'Request body is too large.'}, status=413)
+    except orjson.JSONDecodeError:
+        return json_response({'success': False, 'message': 'Invalid JSON body.'}, status=400)
     except Exception as e:
         logger.error(f"Server error during processing: {e}")
-        return JsonResponse({'success': False, 'message': f'Server error during processing: {e}'}, status=500)
+        return json_response({'success': False, 'message': f'Server error during processing: {e}'}, status=500)
+
+async def process_cv_batch_item(binary, filename, error):
+    if error is None:
+        try:
+            payload, status = await process_cv(binary, filename)
+        except Exception as e:
+            logger.error(f"Server error during processing of {filename}: {e}")
+            payload, status = {'success': False, 'message': f'Server error during processing: {e}'}, 500
+    else:
+        payload, status = error
+    return {'filename': filename, 'status': status, **payload}
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def process_cvs_batch_view(request):
+    # Several CVs in one request: items are processed concurrently, so their Gemini
+    # round-trips overlap (still capped by the loop's Gemini semaphore)
+    try:
+        if request.content_type.startswith('multipart/'):
+            files = request.FILES.getlist('cv')
+        else:
+            data = orjson.loads(request.body)
+            files = data.get('files') if isinstance(data, dict) else None
+            if not isinstance(files, list) or not all(isinstance(item, dict) for item in files):
+                return json_response({'success': False, 'message': 'A list of file objects is required.'}, status=400)
+
+        # Count before reading or decoding anything, so an oversized batch costs nothing
+        if not files:
+            return json_response({'success': False, 'message': 'No files were provided.'}, status=400)
+        if len(files) > settings.MAX_CV_BATCH_FILES:
+            return json_response({'success': False, 'message': f'Too many files (max {settings.MAX_CV_BATCH_FILES}).'}, status=400)
+
+        read_upload = read_multipart_upload if request.content_type.startswith('multipart/') else read_json_upload
+        uploads = [read_upload(item) for item in files]
+
+        results = await asyncio.gather(*(process_cv_batch_item(*upload) for upload in uploads))
+        return json_response({'success': all(r['success'] for r in results), 'results': results})
+
+    except RequestDataTooBig:
+        # Only JSON bodies hit this limit (see DATA_UPLOAD_MAX_MEMORY_SIZE)
+        limit_mb = settings.DATA_UPLOAD_MAX_MEMORY_SIZE // (1024 * 1024)
+        return json_response({
+            'success': False,
+            'message': f'Request body is too large (JSON batches are limited to {limit_mb} MB in total); '
+                       "upload the files as multipart 'cv' parts instead.",
+        }, status=413)
+    except orjson.JSONDecodeError:
+        return json_response({'success': False, 'message': 'Invalid JSON body.'}, status=400)
+    except Exception as e:
+        logger.error(f"Server error during batch processing: {e}")
+        return json_response({'success': False, 'message': f'Server error during processing: {e}'}, status=500)
+
+# Attribute names for the DOCX styling helpers, resolved once instead of via qn()
+# on every call (W_VAL is shared with the text extraction code above)
+W_COLOR = qn('w:color')
+W_FILL = qn('w:fill')
+W_SZ = qn('w:sz')
+W_SPACE = qn('w:space')
+CELL_BORDER_EDGES = tuple((edge, 'w:' + edge) for edge in ('top', 'left', 'bottom', 'right'))
+
+def make_shading(fill_color):
+    return OxmlElement('w:shd', attrs={W_VAL: 'clear', W_COLOR: 'auto', W_FILL: fill_color})
 
 def set_cell_background(cell, fill_color):
-    tcPr = cell._tc.get_or_add_tcPr()
-    shd = OxmlElement('w:shd')
-    shd.set(qn('w:val'), 'clear')
-    shd.set(qn('w:color'), 'auto')
-    shd.set(qn('w:fill'), fill_color)
-    tcPr.append(shd)
+    cell._tc.get_or_add_tcPr().append(make_shading(fill_color))
 
 def set_paragraph_background(paragraph, fill_color):
-    pPr = paragraph._p.get_or_add_pPr()
-    shd = OxmlElement('w:shd')
-    shd.set(qn('w:val'), 'clear')
-    shd.set(qn('w:color'), 'auto')
-    shd.set(qn('w:fill'), fill_color)
-    pPr.append(shd)
+    paragraph._p.get_or_add_pPr().append(make_shading(fill_color))
 
 def set_cell_border(cell, **kwargs):
     tc = cell._tc
@@ -335,27 +901,26 @@ def set_cell_border(cell, **kwargs):
     if tcBorders is None:
         tcBorders = OxmlElement('w:tcBorders')
         tcPr.append(tcBorders)
-    for edge in ('top', 'left', 'bottom', 'right'):
-        if edge in kwargs:
-            edge_data = kwargs.get(edge)
-            tag = 'w:' + edge
-            element = OxmlElement(tag)
-            element.set(qn('w:val'), edge_data.get('val', 'single'))
-            element.set(qn('w:sz'), str(edge_data.get('sz', 4)))
-            element.set(qn('w:space'), str(edge_data.get('space', 0)))
-            element.set(qn('w:color'), edge_data.get('color', '000000'))
-            tcBorders.append(element)
+    for edge, tag in CELL_BORDER_EDGES:
+        edge_data = kwargs.get(edge)
+        if edge_data is not None:
+            tcBorders.append(OxmlElement(tag, attrs={
+                W_VAL: edge_data.get('val', 'single'),
+                W_SZ: str(edge_data.get('sz', 4)),
+                W_SPACE: str(edge_data.get('space', 0)),
+                W_COLOR: edge_data.get('color', '000000'),
+            }))
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
 def generate_docx_view(request):
     try:
-        data = json.loads(request.body)
+        data = orjson.loads(request.body)
         cv_data = data.get('cv_data')
 
         if not cv_data:
-            return JsonResponse({'success': False, 'message': 'CV data is missing.'}, status=400)
+            return json_response({'success': False, 'message': 'CV data is missing.'}, status=400)
 
         docx_file_stream = (cv_data)
         
@@ -367,8 +932,8 @@ def generate_docx_view(request):
         
         return response
 
-    except json.JSONDecodeError:
-        return JsonResponse({'success': False, 'message': 'Invalid JSON body.'}, status=400)
+    except orjson.JSONDecodeError:
+        return json_response({'success': False, 'message': 'Invalid JSON body.'}, status=400)
     except Exception as e:
         logger.error(f"DOCX Generation Server Error: {str(e)} with traceback: {traceback.format_exc()}")
-        return JsonResponse({'success': False, 'message': f'Server error during DOCX generation: {str(e)}'}, status=500)
\ No newline at end of file
+        return json_response({'success': False, 'message': f'Server error during DOCX generation: {str(e)}'}, status=500)
\ No newline at end of file
@@ -94,15 +94,54 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'format.wsgi.application'
+# Production entry point for the async CV views (see gunicorn.conf.py)
+ASGI_APPLICATION = 'format.asgi.application'
 
 # AI/API Configuration
 # Reads GEMINI_API_KEY from config.env
 GEMINI_API_KEY = config('GEMINI_API_KEY', default='')
+# Reads GOOGLE_API_KEY (used by the CV extraction views) from the environment or .env
+GOOGLE_API_KEY = config('GOOGLE_API_KEY', default='')
 
 # Define the model to be used for structured extraction (Hardcoded, as it rarely changes)
 GEMINI_MODEL = 'gemini-2.5-flash-preview-05-20'
 
 
+# Cache
+# Reads REDIS_URL from config.env; falls back to a per-process memory cache when unset
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# How long extracted CV text and parsed CV data are cached, keyed by file content (seconds)
+CV_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+
+# Upload limits for CV processing
+# Largest CV file accepted (bytes); bigger uploads are rejected with 413 before decoding
+MAX_CV_BYTES = 10 * 1024 * 1024
+# Extracted text beyond this many characters (~30k tokens) is cut off before it is
+# sent to Gemini; prompt latency grows roughly linearly with length
+MAX_CV_TEXT_CHARS = 120_000
+# Most CVs accepted in one batch request (api/process-cvs/)
+MAX_CV_BATCH_FILES = 20
+# Let a base64-encoded CV of MAX_CV_BYTES (plus JSON overhead) through Django's body limit.
+# This also caps a whole JSON batch at about MAX_CV_BYTES of files in total; multipart
+# uploads don't count towards it, so larger batches should be sent as multipart.
+DATA_UPLOAD_MAX_MEMORY_SIZE = MAX_CV_BYTES * 4 // 3 + 1024 * 1024
+
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -0,0 +1,6 @@
+# Picked up by a plain `gunicorn` run from the project root.
+# The CV views are async: served over ASGI, each worker keeps one event loop, so
+# concurrent Gemini calls share its semaphore and gRPC client. Under WSGI they still
+# work, but every request pays for a fresh loop and a new Gemini connection.
+wsgi_app = 'format.asgi:application'
+worker_class = 'uvicorn.workers.UvicornWorker'